@@ -1,13 +1,19 @@
 # app.py — Destajo: Horario, Tarifas, Modelos (min estándar), PDFs, Tablero y Nómina
 # ©️ 2025
 
-import os, json, base64, re, hashlib, math, io
+import os, csv, json, base64, re, hashlib, hmac, math, io
 from datetime import datetime, date, time, timedelta, timezone
+from itertools import repeat
 from typing import Optional, Dict, Any, List, Tuple
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_datetime64_any_dtype
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import streamlit as st
+from openpyxl import Workbook
 from zoneinfo import ZoneInfo
 
 # =========================
@@ -17,10 +23,12 @@ APP_TITLE = "Destajo · Horario + Tarifas + Plantillas"
 st.set_page_config(page_title=APP_TITLE, page_icon="🧮", layout="centered")
 
 DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
 
 DB_FILE = os.path.join(DATA_DIR, "registros.parquet")
-AUDIT_FILE = os.path.join(DATA_DIR, "audit.parquet")
+TABLERO_COLS = ["DEPTO", "EMPLEADO", "MODELO", "Produce", "Inicio", "Fin", "Minutos_Proceso", "Pago", "Semana"]
+AUDIT_FILE = os.path.join(DATA_DIR, "audit.parquet")   # histórico previo (solo lectura)
+AUDIT_LOG = os.path.join(DATA_DIR, "audit.csv")         # bitácora append-only: ts,user,action,record_id,details
+AUDIT_COLS = ["ts", "user", "action", "record_id", "details"]
 USERS_FILE = "users.csv"
 
 # Catálogos
@@ -29,7 +37,8 @@ CAT_MOD = os.path.join(DATA_DIR, "cat_modelos.csv")     # columna: modelo
 CAT_MODELO_STD = os.path.join(DATA_DIR, "modelos_std.csv")  # columnas: MODELO, MINUTOS_STD (por pieza)
 
 # Tarifas (área)
-RATES_CSV = os.path.join(DATA_DIR, "rates.csv")         # normalizado desde Excel (hoja 'tiempos')
+RATES_FILE = os.path.join(DATA_DIR, "rates.parquet")    # normalizado desde Excel (hoja 'tiempos')
+RATES_CSV = os.path.join(DATA_DIR, "rates.csv")         # formato previo; solo lectura si aún no hay parquet
 RATES_XLSX = os.path.join(DATA_DIR, "rates_source.xlsx")
 DEFAULT_RATE_SHEET = "tiempos"
 WEEKLY_HOURS_DEFAULT = 55  # horas por semana
@@ -38,8 +47,14 @@ WEEKLY_HOURS_DEFAULT = 55  # horas por semana
 DOCS_DIR = os.path.join(DATA_DIR, "docs")
 DOCS_INDEX = os.path.join(DATA_DIR, "docs_index.csv")   # id,departamento,titulo,tags,filename,relpath,uploaded_by,ts
 THUMBS_DIR = os.path.join(DOCS_DIR, "thumbs")
-os.makedirs(DOCS_DIR, exist_ok=True)
-os.makedirs(THUMBS_DIR, exist_ok=True)
+
+@st.cache_resource(show_spinner=False)
+def init_dirs():
+    """Crea data/, docs/ y thumbs/ una sola vez por proceso (no en cada rerun)."""
+    for d in (DATA_DIR, DOCS_DIR, THUMBS_DIR):
+        os.makedirs(d, exist_ok=True)
+
+init_dirs()
 
 # fallback por si aún no hay tarifas
 DEPT_FALLBACK = ["COSTURA", "TAPIZ", "CARPINTERIA", "COJINERIA", "CORTE", "ARMADO", "HILADO", "COLCHONETA", "RESORTE", "OTRO"]
@@ -66,6 +81,25 @@ def to_utc(dt: datetime) -> datetime:
         dt = dt.replace(tzinfo=LOCAL_TZ)
     return dt.astimezone(timezone.utc)
 
+def to_local_series(s: pd.Series) -> pd.Series:
+    """Columna de fechas (texto, naive=UTC o con zona) a datetime en LOCAL_TZ, en una sola conversión."""
+    if is_datetime64_any_dtype(s):  # ya tipada (parquet): sin parseo
+        return (s.dt.tz_localize("UTC") if s.dt.tz is None else s).dt.tz_convert(LOCAL_TZ)
+    # texto: formato ISO explícito (lo que guarda la app); solo lo que no sea ISO pasa al parser general
+    out = pd.to_datetime(s, errors="coerce", utc=True, format="ISO8601")
+    resto = out.isna() & s.notna()
+    if resto.any():
+        out = out.mask(resto, pd.to_datetime(s[resto], errors="coerce", utc=True, format="mixed"))
+    return out.dt.tz_convert(LOCAL_TZ)
+
+def fechas_utc(df: pd.DataFrame) -> pd.DataFrame:
+    """Inicio/Fin a datetime UTC en el mismo df antes de guardar: el parquet las conserva tipadas y nadie las reparsea.
+    Si ya vienen como datetime con zona no se tocan."""
+    for col in ["Inicio", "Fin"]:
+        if col in df.columns and not (is_datetime64_any_dtype(df[col]) and df[col].dt.tz is not None):
+            df[col] = to_local_series(df[col]).dt.tz_convert("UTC")
+    return df
+
 def as_local_naive(dt: datetime) -> datetime:
     if dt is None or pd.isna(dt):
         return dt
@@ -78,26 +112,92 @@ def now_iso() -> str:
     return now_utc().isoformat(timespec="seconds")  # auditoría en UTC
 
 def week_number(dt: Optional[datetime]):
-    if pd.isna(dt) or dt is None:
+    if dt is None or pd.isna(dt):
         return np.nan
-    return pd.Timestamp(dt).isocalendar().week
+    return dt.isocalendar()[1]  # datetime/Timestamp: sin construir un Timestamp intermedio
 
-def load_parquet(path: str) -> pd.DataFrame:
+# Cargadores cacheados por (ruta, mtime): st.cache_data entrega una copia por llamada (se puede modificar);
+# los de st.cache_resource (tarifas, catálogos, índice de usuarios) comparten el mismo objeto sin copiar: solo lectura.
+@st.cache_data(show_spinner=False, max_entries=8)
+def _load_parquet_cached(path: str, mtime: int, columns: Optional[Tuple[str, ...]]) -> pd.DataFrame:
     if os.path.exists(path):
         try:
-            return pd.read_parquet(path)
+            if columns is not None:
+                presentes = set(pq.read_schema(path).names)
+                columns = [c for c in columns if c in presentes]
+            return pd.read_parquet(path, engine="pyarrow", columns=columns)
         except Exception:
             return pd.DataFrame()
     return pd.DataFrame()
 
+def load_parquet(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Lee un parquet; con `columns` solo carga esas columnas (las que no existan en el archivo se ignoran).
+    Cacheado por (ruta, mtime, columnas): los reruns sin escrituras no vuelven a decodificar el archivo."""
+    return _load_parquet_cached(path, file_mtime(path), tuple(columns) if columns is not None else None)
+
+def file_mtime(path: str) -> int:
+    """mtime en nanosegundos (0 si no existe); llave de caché para invalidar al escribir.
+    En ns para no perder dos guardados dentro del mismo segundo en sistemas con mtime de baja resolución."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
 def save_parquet(df: pd.DataFrame, path: str):
     if df is None:
         return
-    df.to_parquet(path, index=False)
+    df.to_parquet(path, index=False, engine="pyarrow", compression="zstd", compression_level=3)
+    _load_parquet_cached.clear()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV UTF-8 para descargas, con el writer de pyarrow (C++); cacheado por contenido de df."""
+    buf = io.BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
+def append_csv_row(path: str, row: Dict[str, Any]):
+    """Agrega una fila al final del CSV sin releerlo ni reescribirlo; respeta el orden del encabezado existente.
+    ValueError si el encabezado no tiene columna para algún valor no vacío de `row` (no se escribe nada)."""
+    header = None
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        # utf-8-sig: los CSV guardados desde Excel ("CSV UTF-8") empiezan con BOM pegado al primer encabezado
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            header = next(csv.reader(f), None)
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            falta_salto = f.read(1) not in (b"\n", b"\r")
+    if header:
+        cols = {h.strip().lower() for h in header}
+        faltan = [k for k, v in row.items() if v not in ("", None) and k not in cols]
+        if faltan:
+            raise ValueError(f"{os.path.basename(path)} no tiene la(s) columna(s): {', '.join(faltan)}")
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, lineterminator="\n")
+        if not header:
+            header = list(row)
+            w.writerow(header)
+        elif falta_salto:
+            f.write("\n")
+        w.writerow([row.get(h.strip().lower(), "") for h in header])
+
+def upload_nuevo(up, key: str) -> bool:
+    """True solo la primera vez que llega este archivo al uploader `key`.
+    El archivo sigue en el widget tras st.rerun(); sin esto se volvería a leer y guardar en cada rerun."""
+    if up is None:
+        return False
+    fid = getattr(up, "file_id", None) or (up.name, up.size)
+    if st.session_state.get(f"__upload_{key}") == fid:
+        return False
+    st.session_state[f"__upload_{key}"] = fid
+    return True
+
+# regex compiladas una vez al importar (nombres de archivo y espacios en deptos/empleados)
+_RE_NO_ARCHIVO = re.compile(r"[^\w\-. ]+")
+_RE_ESPACIOS = re.compile(r"\s+")
 
 def sanitize_filename(name: str) -> str:
-    base = re.sub(r"[^\w\-. ]+", "_", str(name))
-    return re.sub(r"\s+", "_", base).strip("_")
+    return _RE_ESPACIOS.sub("_", _RE_NO_ARCHIVO.sub("_", str(name))).strip("_")
 
 def hash_relpath(relpath: str) -> str:
     return hashlib.sha1(relpath.encode("utf-8")).hexdigest()[:16]
@@ -112,7 +212,12 @@ def num(val, default=0.0):
         return default
 
 def norm_depto(s: str) -> str:
-    return re.sub(r"\s+", " ", str(s).upper().strip())
+    return _RE_ESPACIOS.sub(" ", str(s).upper().strip())
+
+def norm_depto_series(s: pd.Series) -> pd.Series:
+    """norm_depto vectorizado (métodos .str, sin regex por celda en Python); los NaN se conservan como NaN."""
+    norm = s.astype(str).str.upper().str.strip().str.replace(r"\s+", " ", regex=True)
+    return norm.where(s.notna())  # explícito: en pandas 2.x astype(str) convierte NaN en "nan" -> "NAN"
 
 # =========================
 # Horario laboral (minutos efectivos)
@@ -154,8 +259,35 @@ def working_minutes_between(start: datetime, end: datetime) -> float:
         cur += timedelta(days=1)
     return round(total, 2)
 
+# Misma jornada como función acumulada de la semana: W(t) = minutos laborales desde un lunes de referencia.
+# Así los minutos efectivos de muchos intervalos son W(fin) - W(inicio), sin ciclo por fila ni por día.
+_LUNES_REF = pd.Timestamp("1970-01-05")  # lunes
+
+def _semana_laboral() -> Tuple[np.ndarray, np.ndarray]:
+    """Puntos (minuto de la semana, minutos laborales acumulados) de las ventanas de day_windows, de lunes a domingo."""
+    xp, fp = [0.0], [0.0]
+    for k in range(7):
+        for w_from, w_to in day_windows((_LUNES_REF + timedelta(days=k)).date()):
+            a = k * 1440 + w_from.hour * 60 + w_from.minute
+            b = k * 1440 + w_to.hour * 60 + w_to.minute
+            xp += [a, b]
+            fp += [fp[-1], fp[-1] + (b - a)]
+    return np.array(xp + [7 * 1440.0]), np.array(fp + [fp[-1]])
+
+_SEM_XP, _SEM_FP = _semana_laboral()
+
+def _working_minutes_cum(t: pd.Series) -> np.ndarray:
+    """W(t) para una serie de datetimes locales naive (NaN donde no hay fecha)."""
+    m = ((t - _LUNES_REF) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+    semanas = np.floor(m / (7 * 1440))
+    return semanas * _SEM_FP[-1] + np.interp(m - semanas * 7 * 1440, _SEM_XP, _SEM_FP)
+
+def working_minutes_series(start: pd.Series, end: pd.Series) -> np.ndarray:
+    """working_minutes_between vectorizado; start/end en hora local naive. NaN si falta alguna fecha."""
+    return np.round(np.abs(_working_minutes_cum(end) - _working_minutes_cum(start)), 2)
+
 # =========================
-# Tarifas por área (Excel -> CSV normalizado)
+# Tarifas por área (Excel -> rates.parquet normalizado)
 # =========================
 def find_col(df: pd.DataFrame, keys: List[str]) -> Optional[str]:
     for key in keys:
@@ -164,6 +296,9 @@ def find_col(df: pd.DataFrame, keys: List[str]) -> Optional[str]:
                 return c
     return None
 
+# subcadenas de encabezado que normalize_rates usa para detectar columnas (depto/área y precios)
+RATE_COL_KEYS = ["dept", "departamento", "area", "área", "hr", "hora", "sem", "min", "pieza"]
+
 def normalize_rates(df_in: pd.DataFrame) -> pd.DataFrame:
     cols_out = ["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"]
     if df_in is None or df_in.empty:
@@ -172,19 +307,18 @@ def normalize_rates(df_in: pd.DataFrame) -> pd.DataFrame:
     df = df_in.copy()
     df.columns = [str(c).strip().lower() for c in df.columns]
 
-    dep_col = None
+    # una sola pasada: nombre exacto gana; si no hay, el primero que contenga dept/area
+    dep_exact, dep_fuzzy = None, None
     for c in df.columns:
-        if c in ["depto", "departamento", "area", "área"]:
-            dep_col = c
+        if c in ("depto", "departamento", "area", "área"):
+            dep_exact = c
             break
-    if dep_col is None:
-        cand = [c for c in df.columns if "dept" in c or "area" in c or "área" in c]
-        dep_col = cand[0] if cand else None
+        if dep_fuzzy is None and ("dept" in c or "area" in c or "área" in c):
+            dep_fuzzy = c
+    dep_col = dep_exact if dep_exact is not None else dep_fuzzy
     if dep_col is None:
         return pd.DataFrame(columns=cols_out)
 
-    out = pd.DataFrame({"DEPTO": df[dep_col].astype(str).map(norm_depto)})
-
     c_hr = find_col(df, ["$/hr", "precio_hora", "por_hora", "x_hora", "hora"])
     c_week = find_col(df, ["sem", "semana", "semanal", "$ semana", "$/sem"])
     c_min = find_col(df, ["precio_minuto", "por_min", "x_min", "minuto"])
@@ -196,7 +330,7 @@ def normalize_rates(df_in: pd.DataFrame) -> pd.DataFrame:
         semanal = pd.to_numeric(df[c_week], errors="coerce")
         precio_hora = (semanal / float(WEEKLY_HOURS_DEFAULT)).round(2)
     else:
-        precio_hora = pd.Series([np.nan] * len(df))
+        precio_hora = pd.Series(np.nan, index=df.index)
 
     if c_min and c_min in df.columns:
         precio_min = pd.to_numeric(df[c_min], errors="coerce")
@@ -206,40 +340,71 @@ def normalize_rates(df_in: pd.DataFrame) -> pd.DataFrame:
     if c_pza and c_pza in df.columns:
         precio_pza = pd.to_numeric(df[c_pza], errors="coerce")
     else:
-        precio_pza = pd.Series([np.nan] * len(df))
-
-    out["precio_hora"] = precio_hora
-    out["precio_minuto"] = precio_min
-    out["precio_pieza"] = precio_pza
+        precio_pza = pd.Series(np.nan, index=df.index)
 
+    # un solo DataFrame con todas las columnas (sin ir agregándolas una por una)
+    out = pd.DataFrame({"DEPTO": norm_depto_series(df[dep_col]), "precio_hora": precio_hora,
+                        "precio_minuto": precio_min, "precio_pieza": precio_pza})
     out = (out.groupby("DEPTO", as_index=False)
              .agg({"precio_minuto":"max","precio_pieza":"max","precio_hora":"max"}))
     return out[cols_out]
 
-def load_rates_csv() -> pd.DataFrame:
-    if os.path.exists(RATES_CSV):
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_rates_cached(path: str, mtime: int) -> pd.DataFrame:
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(RATES_CSV)
-            for c in ["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"]:
-                if c not in df.columns:
-                    return pd.DataFrame(columns=["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"])
-            df["DEPTO"] = df["DEPTO"].map(norm_depto)
+            cols = ["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"]
+            # proyección en la lectura: solo las 4 columnas que usa la app
+            df = (pd.read_parquet(path, engine="pyarrow", columns=cols) if path.endswith(".parquet")
+                  else pd.read_csv(path, usecols=lambda c: c in cols))
+            if not set(cols).issubset(df.columns):
+                return pd.DataFrame(columns=["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"])
+            df["DEPTO"] = norm_depto_series(df["DEPTO"])
+            # precios a float una sola vez al cargar (el parquet ya los trae numéricos; el CSV heredado puede traer texto)
+            for c in ["precio_minuto", "precio_pieza", "precio_hora"]:
+                if not is_numeric_dtype(df[c]):
+                    df[c] = pd.to_numeric(df[c], errors="coerce")
             return df
         except Exception:
             pass
     return pd.DataFrame(columns=["DEPTO", "precio_minuto", "precio_pieza", "precio_hora"])
 
-def save_rates_csv(df_rates: pd.DataFrame):
-    df = normalize_rates(df_rates)
-    df.to_csv(RATES_CSV, index=False)
-
-def calc_pago_row(depto: str, produce: float, minutos_ef: float, minutos_std: float, rates: pd.DataFrame) -> Tuple[float, str, float]:
-    """Devuelve (pago, esquema, tarifa_base) con prioridad: minuto → pieza → hora."""
-    dep = norm_depto(depto)
-    r = rates[rates["DEPTO"] == dep]
-    tarifa_min = float(r["precio_minuto"].iloc[0]) if not r.empty and pd.notna(r["precio_minuto"].iloc[0]) else math.nan
-    tarifa_pza = float(r["precio_pieza"].iloc[0]) if not r.empty and pd.notna(r["precio_pieza"].iloc[0]) else math.nan
-    tarifa_hr  = float(r["precio_hora"].iloc[0])  if not r.empty and pd.notna(r["precio_hora"].iloc[0])  else math.nan
+def read_rates_excel(file, sheet_name: str) -> Tuple[pd.DataFrame, str]:
+    """Lee la hoja de tarifas (o la primera si no existe). Usa calamine si está instalado; si no, openpyxl."""
+    try:
+        xls = pd.ExcelFile(file, engine="calamine")
+    except ImportError:
+        xls = pd.ExcelFile(file)
+    sheet = sheet_name if sheet_name in xls.sheet_names else xls.sheet_names[0]
+    # solo columnas que normalize_rates puede reconocer (depto/área y precios); el resto ni se convierte
+    usecols = lambda c: any(k in str(c).strip().lower() for k in RATE_COL_KEYS)
+    return pd.read_excel(xls, sheet_name=sheet, usecols=usecols), sheet
+
+def load_rates() -> pd.DataFrame:
+    path = RATES_FILE if os.path.exists(RATES_FILE) else RATES_CSV
+    return _load_rates_cached(path, file_mtime(path))
+
+def save_rates(df_rates: pd.DataFrame, normalize: bool = True):
+    """Guarda tarifas en parquet (tipos numéricos se conservan al releer)."""
+    df = normalize_rates(df_rates) if normalize else df_rates
+    save_parquet(df, RATES_FILE)
+    _load_rates_cached.clear()
+
+def dept_options_from(rates: pd.DataFrame) -> List[str]:
+    """Departamentos conocidos (fallback + los que tienen tarifa), ordenados."""
+    return sorted(set(DEPT_FALLBACK) | set(rates["DEPTO"].dropna().astype(str)))
+
+def rates_index(rates: pd.DataFrame) -> Dict[str, Tuple[float, float, float]]:
+    """DEPTO -> (precio_minuto, precio_pieza, precio_hora); NaN si no hay tarifa. Conserva la primera fila por DEPTO."""
+    if rates.empty:
+        return {}
+    r = rates.drop_duplicates(subset=["DEPTO"], keep="first")
+    vals = [r[c].to_numpy(dtype=float) for c in ["precio_minuto", "precio_pieza", "precio_hora"]]  # ya numéricos desde load_rates
+    return dict(zip(r["DEPTO"], zip(*vals)))
+
+def calc_pago_row(depto: str, produce: float, minutos_ef: float, minutos_std: float, tarifas: Dict[str, Tuple[float, float, float]]) -> Tuple[float, str, float]:
+    """Devuelve (pago, esquema, tarifa_base) con prioridad: minuto → pieza → hora. `tarifas` viene de rates_index()."""
+    tarifa_min, tarifa_pza, tarifa_hr = tarifas.get(norm_depto(depto), (math.nan, math.nan, math.nan))
 
     if not math.isnan(tarifa_min):
         return (round(minutos_ef * tarifa_min, 2), "minuto", tarifa_min)
@@ -249,13 +414,9 @@ def calc_pago_row(depto: str, produce: float, minutos_ef: float, minutos_std: fl
         return (round((minutos_ef / 60.0) * tarifa_hr, 2), "hora", tarifa_hr)
     return (0.0, "sin_tarifa", 0.0)
 
-def calc_pago_estandar(depto: str, produce: float, minutos_estandar: float, rates: pd.DataFrame) -> float:
+def calc_pago_estandar(depto: str, produce: float, minutos_estandar: float, tarifas: Dict[str, Tuple[float, float, float]]) -> float:
     """Pago teórico usando minutos estándar por MODELO (por pieza * piezas)."""
-    dep = norm_depto(depto)
-    r = rates[rates["DEPTO"] == dep]
-    tarifa_min = float(r["precio_minuto"].iloc[0]) if not r.empty and pd.notna(r["precio_minuto"].iloc[0]) else math.nan
-    tarifa_pza = float(r["precio_pieza"].iloc[0]) if not r.empty and pd.notna(r["precio_pieza"].iloc[0]) else math.nan
-    tarifa_hr  = float(r["precio_hora"].iloc[0])  if not r.empty and pd.notna(r["precio_hora"].iloc[0])  else math.nan
+    tarifa_min, tarifa_pza, tarifa_hr = tarifas.get(norm_depto(depto), (math.nan, math.nan, math.nan))
     if not math.isnan(tarifa_min):
         return round(minutos_estandar * tarifa_min, 2)
     if not math.isnan(tarifa_hr):
@@ -264,13 +425,23 @@ def calc_pago_estandar(depto: str, produce: float, minutos_estandar: float, rate
         return round(produce * tarifa_pza, 2)
     return 0.0
 
+def redondear_centavos(a: np.ndarray) -> np.ndarray:
+    """round(x, 2) de Python elemento a elemento: mismo redondeo que calc_pago_row (np.round difiere en medios centavos)."""
+    return np.fromiter(map(round, a.tolist(), repeat(2)), dtype=float, count=len(a))
+
+def tarifas_por_fila(depto: pd.Series, tarifas: Dict[str, Tuple[float, float, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(tarifa_min, tarifa_pza, tarifa_hr) alineadas a `depto` (ya normalizado); NaN donde el depto no tiene tarifa."""
+    t = pd.DataFrame.from_dict(tarifas, orient="index", columns=["min", "pza", "hr"]).reindex(depto.astype(object))
+    return t["min"].to_numpy(dtype=float), t["pza"].to_numpy(dtype=float), t["hr"].to_numpy(dtype=float)
+
 # =========================
 # Usuarios y roles
 # =========================
-def load_users() -> pd.DataFrame:
-    if os.path.exists(USERS_FILE):
+def _read_users(path: str) -> pd.DataFrame:
+    """users.csv (o los usuarios por defecto) sin caché: solo lo consume _users_index, que guarda hashes y no PINs."""
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(USERS_FILE, dtype=str)
+            df = pd.read_csv(path, dtype=str)
             df.columns = [c.strip().lower() for c in df.columns]
             return df
         except Exception:
@@ -283,6 +454,35 @@ def load_users() -> pd.DataFrame:
         {"user": "productividad", "role": "Productividad", "pin": "4444"},
     ])
 
+def pin_hash(pin: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(str(pin).encode("utf-8"), salt=salt, n=2**14, r=8, p=1)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _users_index(path: str, mtime: int) -> Dict[str, List[Tuple[str, str, bytes, bytes]]]:
+    """usuario en minúsculas -> [(usuario, rol, sal, hash del pin)] en orden del archivo.
+    El CSV se lee aquí mismo y no se cachea: lo único que persiste por versión del archivo son los hashes."""
+    users = _read_users(path).dropna(subset=["user", "pin"])
+    idx: Dict[str, List[Tuple[str, str, bytes, bytes]]] = {}
+    for user, pin, role in zip(users["user"], users["pin"], users["role"]):
+        salt = os.urandom(16)
+        idx.setdefault(user.lower(), []).append((user, role, salt, pin_hash(pin, salt)))
+    return idx
+
+# usuario inexistente: se calcula igual un scrypt contra valores fijos para no revelar por tiempo qué usuarios existen
+_SAL_FICTICIA = bytes(16)
+_HASH_FICTICIO = bytes(64)  # largo de la salida de scrypt (dklen por defecto)
+
+def check_login(u: str, p: str) -> Optional[Tuple[str, str]]:
+    """(usuario, rol) si el PIN coincide; comparación en tiempo constante. Gana la primera fila, como el filtro anterior."""
+    candidatos = _users_index(USERS_FILE, file_mtime(USERS_FILE)).get(str(u).lower())
+    if not candidatos:
+        hmac.compare_digest(pin_hash(p, _SAL_FICTICIA), _HASH_FICTICIO)
+        return None
+    for user, role, salt, h in candidatos:
+        if hmac.compare_digest(pin_hash(p, salt), h):
+            return user, role
+    return None
+
 ROLE_PERMS = {
     "Admin": {"editable": True, "can_delete": True},
     "Supervisor": {"editable": True, "can_delete": False},
@@ -293,14 +493,12 @@ ROLE_PERMS = {
 
 def login_box():
     st.header("Iniciar sesión")
-    users = load_users()
     u = st.text_input("Usuario")
     p = st.text_input("PIN", type="password")
     if st.button("Entrar", use_container_width=True):
-        row = users[(users["user"].str.lower() == str(u).lower()) & (users["pin"] == str(p))]
-        if not row.empty:
-            st.session_state.user = row.iloc[0]["user"]
-            st.session_state.role = row.iloc[0]["role"]
+        match = check_login(u, p)
+        if match:
+            st.session_state.user, st.session_state.role = match
             st.rerun()
         else:
             st.error("Usuario o PIN incorrectos.")
@@ -322,14 +520,15 @@ if st.sidebar.button("Cerrar sesión"):
 # =========================
 # Catálogos
 # =========================
-def load_emp_catalog() -> pd.DataFrame:
-    if os.path.exists(CAT_EMP):
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_emp_catalog_cached(path: str, mtime: int) -> pd.DataFrame:
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(CAT_EMP, dtype=str, keep_default_na=False)
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
             df.columns = [c.strip().lower() for c in df.columns]
             if not {"departamento","empleado"}.issubset(df.columns):
                 return pd.DataFrame(columns=["departamento","empleado"])
-            df["departamento"] = df["departamento"].map(norm_depto)
+            df["departamento"] = norm_depto_series(df["departamento"])
             df["empleado"] = df["empleado"].astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
             df = df[(df["departamento"]!="") & (df["empleado"]!="")]
             df = df.drop_duplicates(subset=["departamento","empleado"], keep="first")
@@ -337,11 +536,16 @@ def load_emp_catalog() -> pd.DataFrame:
                 df["__orden"] = pd.to_numeric(df["orden"], errors="coerce")
                 df = df.sort_values(by=["departamento","__orden"], kind="stable")
                 df = df.drop(columns=["__orden"])
+            # pocos departamentos repetidos: category compara por códigos al filtrar y ocupa menos memoria en caché
+            df["departamento"] = df["departamento"].astype("category")
             return df.reset_index(drop=True)
         except Exception:
             pass
     return pd.DataFrame(columns=["departamento","empleado"])
 
+def load_emp_catalog() -> pd.DataFrame:
+    return _load_emp_catalog_cached(CAT_EMP, file_mtime(CAT_EMP))
+
 def save_emp_catalog(df: pd.DataFrame):
     os.makedirs(os.path.dirname(CAT_EMP), exist_ok=True)
     if df is None:
@@ -349,37 +553,62 @@ def save_emp_catalog(df: pd.DataFrame):
     df = df.fillna("")
     df.columns = [c.strip().lower() for c in df.columns]
     if "departamento" in df.columns:
-        df["departamento"] = df["departamento"].map(norm_depto)
+        df["departamento"] = norm_depto_series(df["departamento"])
     if "empleado" in df.columns:
         df["empleado"] = df["empleado"].astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
     df = df[(df["departamento"]!="") & (df["empleado"]!="")]
     df = df.drop_duplicates(subset=["departamento","empleado"], keep="first")
     df.to_csv(CAT_EMP, index=False)
+    _load_emp_catalog_cached.clear()
+    _emp_options_index.clear()
+
+def add_emp_catalog(departamento: str, empleado: str):
+    """Alta de un empleado: agrega una fila a cat_empleados.csv (sin reconstruir ni reescribir el catálogo)."""
+    append_csv_row(CAT_EMP, {"departamento": norm_depto(departamento), "empleado": _RE_ESPACIOS.sub(" ", str(empleado)).strip()})
+    _load_emp_catalog_cached.clear()
+    _emp_options_index.clear()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _emp_options_index(path: str, mtime: int) -> Dict[str, List[str]]:
+    """departamento -> empleados (orden del catálogo); un groupby por versión del archivo."""
+    cat = _load_emp_catalog_cached(path, mtime)
+    if cat.empty:
+        return {}
+    return {str(dep): g.astype(str).tolist() for dep, g in cat.groupby("departamento", observed=True, sort=False)["empleado"]}
 
 def emp_options_for(depto: str) -> List[str]:
-    dep = norm_depto(depto)
-    cat = load_emp_catalog()
-    return cat.loc[cat["departamento"]==dep, "empleado"].astype(str).tolist()
+    return _emp_options_index(CAT_EMP, file_mtime(CAT_EMP)).get(norm_depto(depto), [])
 
-def load_model_catalog() -> List[str]:
-    if os.path.exists(CAT_MOD):
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_model_catalog_cached(path: str, mtime: int) -> List[str]:
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(CAT_MOD, dtype=str)
+            df = pd.read_csv(path, dtype=str, usecols=lambda c: c == "modelo")
             if "modelo" in df.columns:
-                items = [x.strip() for x in df["modelo"].dropna().astype(str).tolist() if x.strip()]
-                return list(dict.fromkeys(items))  # preserva orden de archivo
+                m = df["modelo"].str.strip()
+                return pd.unique(m[m.notna() & (m != "")]).tolist()  # sin duplicados, en el orden del archivo
         except Exception:
             pass
     return []
 
+def load_model_catalog() -> List[str]:
+    return _load_model_catalog_cached(CAT_MOD, file_mtime(CAT_MOD))
+
 def save_model_catalog(items: List[str]):
-    clean = list(dict.fromkeys([str(x).strip() for x in items if str(x).strip()]))
-    pd.DataFrame({"modelo": clean}).to_csv(CAT_MOD, index=False)
+    m = pd.Series([str(x) for x in items], dtype=str).str.strip()
+    pd.DataFrame({"modelo": pd.unique(m[m != ""])}).to_csv(CAT_MOD, index=False)
+    _load_model_catalog_cached.clear()
 
-def load_model_std() -> pd.DataFrame:
-    if os.path.exists(CAT_MODELO_STD):
+def add_model_catalog(modelo: str):
+    """Alta de un modelo: agrega una fila a cat_modelos.csv sin reescribir el catálogo."""
+    append_csv_row(CAT_MOD, {"modelo": str(modelo).strip()})
+    _load_model_catalog_cached.clear()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_model_std_cached(path: str, mtime: int) -> pd.DataFrame:
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(CAT_MODELO_STD)
+            df = pd.read_csv(path, usecols=lambda c: c.strip().upper() in ("MODELO", "MINUTOS_STD"))
             df.columns = [c.strip().upper() for c in df.columns]
             if not {"MODELO","MINUTOS_STD"}.issubset(df.columns):
                 return pd.DataFrame(columns=["MODELO","MINUTOS_STD"])
@@ -390,9 +619,13 @@ def load_model_std() -> pd.DataFrame:
             pass
     return pd.DataFrame(columns=["MODELO","MINUTOS_STD"])
 
+def load_model_std() -> pd.DataFrame:
+    return _load_model_std_cached(CAT_MODELO_STD, file_mtime(CAT_MODELO_STD))
+
 def save_model_std(df: pd.DataFrame):
     if df is None or df.empty:
         pd.DataFrame(columns=["MODELO","MINUTOS_STD"]).to_csv(CAT_MODELO_STD, index=False)
+        _load_model_std_cached.clear()
         return
     out = df.copy()
     out.columns = [c.strip().upper() for c in out.columns]
@@ -401,6 +634,7 @@ def save_model_std(df: pd.DataFrame):
     out["MINUTOS_STD"] = pd.to_numeric(out["MINUTOS_STD"], errors="coerce").fillna(0.0)
     out = out.drop_duplicates(subset=["MODELO"], keep="last")
     out.to_csv(CAT_MODELO_STD, index=False)
+    _load_model_std_cached.clear()
 
 # =========================
 # Auditoría
@@ -408,31 +642,61 @@ def save_model_std(df: pd.DataFrame):
 def log_audit(user: str, action: str, record_id: Optional[int], details: Dict[str, Any]):
     payload = json.dumps(details, ensure_ascii=False,
                          default=lambda o: o.isoformat() if hasattr(o, "isoformat") else str(o))
-    aud = load_parquet(AUDIT_FILE)
-    row = {"ts": now_iso(), "user": user, "action": action,
-           "record_id": int(record_id) if record_id is not None else None, "details": payload}
-    aud = pd.concat([aud, pd.DataFrame([row])], ignore_index=True)
-    save_parquet(aud, AUDIT_FILE)
+    vals = [now_iso(), user, action, int(record_id) if record_id is not None else None, payload]
+    # solo se agrega la fila nueva (encabezado si el archivo no existe o está vacío), sin reescribir la bitácora
+    append_csv_row(AUDIT_LOG, dict(zip(AUDIT_COLS, vals)))
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_audit_cached(log_mtime: int, hist_mtime: int, tail: Optional[int]) -> pd.DataFrame:
+    frames = [load_parquet(AUDIT_FILE)]
+    if os.path.exists(AUDIT_LOG):
+        try:
+            # lector CSV de Arrow (multi-hilo); columnas de texto fijas para que ts/details no se infieran como fecha/número
+            opts = pa_csv.ConvertOptions(column_types={c: pa.string() for c in ["ts", "user", "action", "details"]},
+                                         strings_can_be_null=True)
+            frames.append(pa_csv.read_csv(AUDIT_LOG, convert_options=opts).to_pandas())
+        except Exception:
+            pass
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=AUDIT_COLS)
+    audit = pd.concat(frames, ignore_index=True)
+    return audit.tail(tail) if tail is not None else audit
+
+def load_audit(tail: Optional[int] = None) -> pd.DataFrame:
+    """Bitácora: histórico en parquet (si existe) + log CSV append-only; con `tail`, solo las últimas filas.
+    Cacheada por el mtime de ambos archivos: se reparsea solo cuando se registra un evento."""
+    return _load_audit_cached(file_mtime(AUDIT_LOG), file_mtime(AUDIT_FILE), tail)
 
 # =========================
 # PDFs (miniaturas + visor)
 # =========================
-def load_docs_index() -> pd.DataFrame:
-    if os.path.exists(DOCS_INDEX):
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_docs_index_cached(path: str, mtime: int) -> pd.DataFrame:
+    if os.path.exists(path):
         try:
-            df = pd.read_csv(DOCS_INDEX, dtype=str)
+            df = pd.read_csv(path, dtype=str)
             need = ["id", "departamento", "titulo", "tags", "filename", "relpath", "uploaded_by", "ts"]
-            for c in need:
-                if c not in df.columns:
-                    return pd.DataFrame(columns=need)
+            if not set(need).issubset(df.columns):
+                return pd.DataFrame(columns=need)
             return df
         except Exception:
             pass
     return pd.DataFrame(columns=["id", "departamento", "titulo", "tags", "filename", "relpath", "uploaded_by", "ts"])
 
-def save_docs_index(df: pd.DataFrame):
-    os.makedirs(DOCS_DIR, exist_ok=True)
-    df.to_csv(DOCS_INDEX, index=False)
+def load_docs_index() -> pd.DataFrame:
+    return _load_docs_index_cached(DOCS_INDEX, file_mtime(DOCS_INDEX))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_file_bytes(path: str, mtime: int) -> bytes:
+    """Bytes del archivo; cacheado por (ruta, mtime) para no releer PDFs en cada rerun."""
+    with open(path, "rb") as f:
+        return f.read()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def pdf_b64(path: str, mtime: int) -> str:
+    """PDF en base64 para el visor; cacheado por (ruta, mtime) para no recodificar el archivo en cada rerun."""
+    return base64.b64encode(read_file_bytes(path, mtime)).decode("utf-8")
 
 def thumb_path_for(relpath: str) -> str:
     h = hash_relpath(relpath)
@@ -446,44 +710,31 @@ def ensure_pdf_thumbnail(relpath: str, max_w: int = 360, dpi: int = 110) -> Opti
         if os.path.exists(png_path):
             return png_path
         import fitz  # PyMuPDF
-        doc = fitz.open(abs_pdf)
-        if doc.page_count == 0:
-            return None
-        page = doc.load_page(0)
-        pix = page.get_pixmap(dpi=dpi)
-        if pix.width > max_w:
-            scale = max_w / pix.width
-            mat = fitz.Matrix(scale, scale)
-            pix = page.get_pixmap(matrix=mat, dpi=dpi)
-        pix.save(png_path)
-        doc.close()
+        with fitz.open(abs_pdf) as doc:
+            if doc.page_count == 0:
+                return None
+            page = doc.load_page(0)
+            # un solo render ya al ancho final (con dpi= PyMuPDF ignora la matriz y el recorte a max_w no aplicaba)
+            zoom = min(dpi / 72.0, max_w / page.rect.width)
+            page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(png_path)
         return png_path if os.path.exists(png_path) else None
     except Exception:
         return None
 
 def show_pdf_file(path: str, height: int = 680):
     try:
-        with open(path, "rb") as f:
-            data = f.read()
-        b64 = base64.b64encode(data).decode("utf-8")
+        mtime = file_mtime(path)
         try:
             from streamlit_pdf_viewer import pdf_viewer
-            pdf_viewer(b64, width=0, height=height, scrolling=True)
+            pdf_viewer(read_file_bytes(path, mtime), width=0, height=height, scrolling=True)  # bytes directos: un str lo toma como ruta/URL
         except Exception:
+            # base64 solo para este respaldo (iframe); con el visor el PDF no se incrusta en el HTML
             st.components.v1.html(
-                f"""<iframe src="data:application/pdf;base64,{b64}" width="100%" height="{height}" style="border:none;"></iframe>""",
+                f"""<iframe src="data:application/pdf;base64,{pdf_b64(path, mtime)}" width="100%" height="{height}" style="border:none;"></iframe>""",
                 height=height+10,
             )
-        colA, colB = st.columns(2)
-        with colA:
-            st.markdown(
-                f"""<a href="data:application/pdf;base64,{b64}" target="_blank" rel="noopener"
-                style="display:inline-block;padding:0.6rem 1rem;border:1px solid #777;border-radius:6px;text-decoration:none">
-                🔎 Abrir en pestaña nueva</a>""",
-                unsafe_allow_html=True,
-            )
-        with colB:
-            st.download_button("⬇️ Descargar PDF", data=data, file_name=os.path.basename(path), mime="application/pdf", use_container_width=True)
+        # sin enlace data: "abrir en pestaña": los navegadores bloquean esa navegación y duplicaba el PDF en la página
+        st.download_button("⬇️ Descargar PDF", data=lambda: read_file_bytes(path, mtime), file_name=os.path.basename(path), mime="application/pdf", use_container_width=True)
     except Exception as e:
         st.error(f"No se pudo mostrar/servir el PDF: {e}")
 
@@ -498,125 +749,179 @@ def compute_minutes_and_pay(df: pd.DataFrame, rates: pd.DataFrame, modelos_std:
 
     # Normalización de columnas base
     if "DEPTO" in d.columns:
-        d["DEPTO"] = d["DEPTO"].map(norm_depto)
-    if "Inicio" in d.columns:
-        d["Inicio"] = pd.to_datetime(d["Inicio"], errors="coerce", utc=True).dt.tz_convert(LOCAL_TZ)
-    if "Fin" in d.columns:
-        d["Fin"] = pd.to_datetime(d["Fin"], errors="coerce", utc=True).dt.tz_convert(LOCAL_TZ)
+        d["DEPTO"] = norm_depto_series(d["DEPTO"])
+    for col in ["Inicio", "Fin"]:
+        if col in d.columns:
+            d[col] = to_local_series(d[col])
+    # columnas numéricas: se tipan una sola vez aquí; el resto de la función (y el Tablero) ya no las coerciona
+    # (el parquet ya los trae tipados: solo se convierte si la columna no es numérica y solo se rellena si hay NaN)
+    for col in ["Produce", "Minutos_Proceso", "Pago"]:
+        if col in d.columns:
+            c = d[col] if is_numeric_dtype(d[col]) else pd.to_numeric(d[col], errors="coerce")
+            d[col] = c.fillna(0) if c.hasnans else c
+    if "Semana" in d.columns and not is_numeric_dtype(d["Semana"]):
+        d["Semana"] = pd.to_numeric(d["Semana"], errors="coerce")
 
     now_loc = datetime.now(LOCAL_TZ)
+    tarifas = rates_index(rates)  # dict DEPTO -> tarifas, una sola vez (sin filtrar el DataFrame por fila)
 
-    def mins_row(r):
-        ini, fin = r.get("Inicio"), r.get("Fin")
-        if pd.notna(ini) and (pd.isna(fin) or ini == fin):
-            return working_minutes_between(ini, now_loc)
-        if pd.notna(ini) and pd.notna(fin):
-            return working_minutes_between(ini, fin)
-        return float(r.get("Minutos_Proceso", 0) or 0)
-
-    d["Minutos_Calc"] = d.apply(mins_row, axis=1).astype(float)
-
-    # Pago real (según minutos efectivos) y tarifa
-    def pay_row(r):
-        p, esq, tar = calc_pago_row(
-            str(r.get("DEPTO","")).upper(),
-            num(r.get("Produce"), 0.0),
-            float(r.get("Minutos_Calc", 0.0)),
-            0.0,
-            rates
-        )
-        return pd.Series({"Pago_Calc": p, "Esquema_Calc": esq, "Tarifa_Calc": tar})
-
-    d = pd.concat([d, d.apply(pay_row, axis=1)], axis=1)
+    # minutos efectivos vectorizados; abiertos (Fin vacío o igual a Inicio) cuentan hasta ahora
+    fallback = d["Minutos_Proceso"].astype(float) if "Minutos_Proceso" in d.columns else pd.Series(0.0, index=d.index)
+    if "Inicio" in d.columns:
+        ini = d["Inicio"].dt.tz_localize(None)
+        fin = d["Fin"].dt.tz_localize(None) if "Fin" in d.columns else pd.Series(pd.NaT, index=d.index, dtype=ini.dtype)
+        abierto = ini.notna() & (fin.isna() | (ini == fin))
+        fin = fin.mask(abierto, now_loc.replace(tzinfo=None))
+        d["Minutos_Calc"] = np.where(ini.notna() & fin.notna(), working_minutes_series(ini, fin), fallback)
+    else:
+        d["Minutos_Calc"] = fallback
+
+    # Pago real (según minutos efectivos) y tarifa: misma prioridad que calc_pago_row (minuto → pieza → hora), por columnas
+    depto = d["DEPTO"] if "DEPTO" in d.columns else pd.Series(np.nan, index=d.index)
+    t_min, t_pza, t_hr = tarifas_por_fila(depto, tarifas)
+    produce = d["Produce"].to_numpy(dtype=float) if "Produce" in d.columns else np.zeros(len(d))
+    mins = d["Minutos_Calc"].to_numpy(dtype=float)
+    con_min = ~np.isnan(t_min)
+    con_pza = ~con_min & ~np.isnan(t_pza)
+    con_hr = ~con_min & ~con_pza & ~np.isnan(t_hr)
+    esquemas = [con_min, con_pza, con_hr]
+    d["Pago_Calc"] = redondear_centavos(np.select(esquemas, [mins * t_min, produce * t_pza, mins / 60.0 * t_hr], 0.0))
+    d["Esquema_Calc"] = np.select(esquemas, ["minuto", "pieza", "hora"], "sin_tarifa")
+    d["Tarifa_Calc"] = np.select(esquemas, [t_min, t_pza, t_hr], 0.0)
 
     # Pago estándar (minutos por modelo * piezas)
-    modelos_std = modelos_std.copy()
     if not modelos_std.empty:
-        modelos_std["MODELO"] = modelos_std["MODELO"].astype(str).str.strip()
+        # lookup indexado MODELO -> MINUTOS_STD (sin merge: no reindexa ni duplica filas si el catálogo repite modelo)
+        std_min = (modelos_std.assign(MODELO=modelos_std["MODELO"].astype(str).str.strip())
+                              .drop_duplicates(subset=["MODELO"], keep="last")
+                              .set_index("MODELO")["MINUTOS_STD"])
         d["MODELO"] = d["MODELO"].astype(str).str.strip()
-        d = d.merge(modelos_std, how="left", on="MODELO")
-        d["MINUTOS_STD"] = pd.to_numeric(d["MINUTOS_STD"], errors="coerce").fillna(0.0)
-        d["Minutos_Estandar"] = (pd.to_numeric(d.get("Produce", 0), errors="coerce").fillna(0.0) * d["MINUTOS_STD"]).round(2)
-        d["Pago_Estandar"] = d.apply(
-            lambda r: calc_pago_estandar(str(r.get("DEPTO","")), num(r.get("Produce"),0.0), float(r.get("Minutos_Estandar",0.0)), rates),
-            axis=1
-        )
+        d["MINUTOS_STD"] = d["MODELO"].map(std_min).fillna(0.0)
+        d["Minutos_Estandar"] = (d.get("Produce", 0.0) * d["MINUTOS_STD"]).round(2)
+        # prioridad de calc_pago_estandar: minuto → hora → pieza
+        m_std = d["Minutos_Estandar"].to_numpy(dtype=float)
+        con_min_std = ~np.isnan(t_min)
+        con_hr_std = ~con_min_std & ~np.isnan(t_hr)
+        con_pza_std = ~con_min_std & ~con_hr_std & ~np.isnan(t_pza)
+        d["Pago_Estandar"] = redondear_centavos(np.select([con_min_std, con_hr_std, con_pza_std],
+                                                          [m_std * t_min, m_std / 60.0 * t_hr, produce * t_pza], 0.0))
     else:
         d["Minutos_Estandar"] = 0.0
         d["Pago_Estandar"] = 0.0
 
     # Resolver columnas visibles
     if "Minutos_Proceso" in d.columns:
-        d["Minutos_Proceso"] = np.where(pd.to_numeric(d["Minutos_Proceso"], errors="coerce").fillna(0) > 0,
-                                        d["Minutos_Proceso"], d["Minutos_Calc"])
+        d["Minutos_Proceso"] = np.where(d["Minutos_Proceso"] > 0, d["Minutos_Proceso"], d["Minutos_Calc"])
     else:
         d["Minutos_Proceso"] = d["Minutos_Calc"]
 
     if "Pago" in d.columns:
-        d["Pago"] = np.where(pd.to_numeric(d["Pago"], errors="coerce").fillna(0) > 0,
-                             d["Pago"], d["Pago_Calc"])
+        d["Pago"] = np.where(d["Pago"] > 0, d["Pago"], d["Pago_Calc"])
     else:
         d["Pago"] = d["Pago_Calc"]
 
     d["Minutos_Proceso"] = d["Minutos_Proceso"].round(2)
     d["Pago"] = d["Pago"].round(2)
 
-    # auxiliares para agrupaciones (desde hora local)
+    # auxiliares para agrupaciones (Inicio ya está en hora local)
+    if "Inicio" in d.columns:
+        d["Fecha"] = d["Inicio"].dt.date
     if "Inicio" in d.columns:
-        d["Fecha"] = d["Inicio"].dt.tz_convert(LOCAL_TZ).dt.date
-    if "Semana" not in d.columns and "Inicio" in d.columns:
-        d["Semana"] = d["Inicio"].dt.isocalendar().week
+        # semana ISO vectorizada; solo rellena las filas sin Semana (week_number queda para la captura)
+        sem_iso = d["Inicio"].dt.isocalendar().week
+        if "Semana" not in d.columns:
+            d["Semana"] = sem_iso
+        elif d["Semana"].hasnans:
+            d["Semana"] = d["Semana"].fillna(sem_iso.astype(float))
 
     # métricas comparativas
     d["Diferencia_Pago"] = (d["Pago"] - d["Pago_Estandar"]).round(2)
-    d["Eficiencia"] = np.where(d["Minutos_Estandar"] > 0, (d["Minutos_Estandar"] / d["Minutos_Proceso"]).round(2), np.nan)
+    # división solo donde ambos > 0 (sin inf ni warnings cuando Minutos_Proceso es 0)
+    est = d["Minutos_Estandar"].to_numpy(dtype=float)
+    proc = d["Minutos_Proceso"].to_numpy(dtype=float)
+    d["Eficiencia"] = np.round(np.divide(est, proc, out=np.full(len(d), np.nan), where=(est > 0) & (proc > 0)), 2)
+
+    # claves de agrupación con pocos valores distintos: category (menos memoria y groupby por códigos en Tablero/nómina)
+    for col in ["DEPTO", "EMPLEADO", "MODELO"]:
+        if col in d.columns:
+            d[col] = d[col].astype("category")
 
     return d
 
-def export_nomina(df: pd.DataFrame) -> bytes:
-    """Genera un XLSX con Detalle (incluye pagos estándar), Día y Semana."""
+def append_sheet(wb: Workbook, name: str, df: pd.DataFrame):
+    """Escribe df en una hoja write-only fila por fila (sin materializar objetos Cell)."""
+    ws = wb.create_sheet(title=name)
+    ws.append([str(c) for c in df.columns])
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(list(row))
+
+NOMINA_SUMAS = {"Pago": "Pagos_Real", "Pago_Estandar": "Pagos_Estandar", "Minutos_Proceso": "Minutos",
+                "Minutos_Estandar": "Min_Estd", "Produce": "Piezas"}
+
+def resumen_nomina(df: pd.DataFrame) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """Totales real vs estándar por EMPLEADO y MODELO: (por Fecha, por Semana). None si faltan columnas.
+    Un solo groupby fino (EMPLEADO, MODELO, Fecha, Semana) que después se agrega a cada periodo."""
+    periodos = [p for p in ["Fecha", "Semana"] if p in df.columns]
+    if not periodos or not set(["EMPLEADO", "MODELO"] + list(NOMINA_SUMAS)).issubset(df.columns):
+        return None, None
+    # observed=True explícito: EMPLEADO/MODELO son category y en pandas 2.x el default arma el producto cartesiano en ceros
+    base = df.groupby(["EMPLEADO", "MODELO"] + periodos, dropna=False, sort=False, observed=True)[list(NOMINA_SUMAS)].sum()
+
+    def totales(periodo: str) -> Optional[pd.DataFrame]:
+        if periodo not in periodos:
+            return None
+        out = (base.groupby(level=["EMPLEADO", "MODELO", periodo], dropna=False, observed=True).sum()
+                   .rename(columns=NOMINA_SUMAS).reset_index())
+        out["Horas"] = (out["Minutos"] / 60).round(2)
+        out["Diferencia"] = (out["Pagos_Real"] - out["Pagos_Estandar"]).round(2)
+        return out
+
+    return totales("Fecha"), totales("Semana")
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def export_nomina(df: pd.DataFrame, dia: Optional[pd.DataFrame] = None, sem: Optional[pd.DataFrame] = None) -> bytes:
+    """Genera un XLSX con Detalle (incluye pagos estándar), Día y Semana.
+    dia/sem: resúmenes ya calculados por resumen_nomina (se recalculan si no se pasan).
+    Cacheado por contenido de los argumentos: si la vista filtrada no cambia, se reutilizan los bytes."""
     output = io.BytesIO()
     df_x = df.copy()
     for col in ["Inicio", "Fin"]:
         if col in df_x.columns:
             try:
-                df_x[col] = pd.to_datetime(df_x[col], errors="coerce").dt.tz_localize(None)
+                s = df_x[col] if is_datetime64_any_dtype(df_x[col]) else pd.to_datetime(df_x[col], errors="coerce", format="ISO8601")
+                df_x[col] = s.dt.tz_localize(None)
             except Exception:
                 pass
-    with pd.ExcelWriter(output, engine="openpyxl") as xw:
-        detalle_cols = [c for c in ["DEPTO","EMPLEADO","MODELO","Produce","Inicio","Fin","Minutos_Proceso","Pago","Minutos_Estandar","Pago_Estandar","Diferencia_Pago","Semana","Fecha"] if c in df_x.columns]
-        df_x[detalle_cols].to_excel(xw, index=False, sheet_name="Detalle")
-
-        need_day = {"EMPLEADO","MODELO","Fecha","Pago","Minutos_Proceso","Pago_Estandar"}
-        if need_day.issubset(df_x.columns):
-            dia = (df_x.groupby(["EMPLEADO","MODELO","Fecha"], dropna=False)
-                     .agg(Pagos_Real=("Pago","sum"),
-                          Pagos_Estandar=("Pago_Estandar","sum"),
-                          Minutos=("Minutos_Proceso","sum"),
-                          Min_Estd=("Minutos_Estandar","sum"),
-                          Piezas=("Produce","sum"))
-                     .reset_index())
-            dia["Horas"] = (dia["Minutos"] / 60).round(2)
-            dia["Diferencia"] = (dia["Pagos_Real"] - dia["Pagos_Estandar"]).round(2)
-            dia.to_excel(xw, index=False, sheet_name="Nomina_Diaria")
-
-        need_week = {"EMPLEADO","MODELO","Semana","Pago","Minutos_Proceso","Pago_Estandar"}
-        if need_week.issubset(df_x.columns):
-            sem = (df_x.groupby(["EMPLEADO","MODELO","Semana"], dropna=False)
-                     .agg(Pagos_Real=("Pago","sum"),
-                          Pagos_Estandar=("Pago_Estandar","sum"),
-                          Minutos=("Minutos_Proceso","sum"),
-                          Min_Estd=("Minutos_Estandar","sum"),
-                          Piezas=("Produce","sum"))
-                     .reset_index())
-            sem["Horas"] = (sem["Minutos"] / 60).round(2)
-            sem["Diferencia"] = (sem["Pagos_Real"] - sem["Pagos_Estandar"]).round(2)
-            sem.to_excel(xw, index=False, sheet_name="Nomina_Semanal")
+    wb = Workbook(write_only=True)
+    detalle_cols = [c for c in ["DEPTO","EMPLEADO","MODELO","Produce","Inicio","Fin","Minutos_Proceso","Pago","Minutos_Estandar","Pago_Estandar","Diferencia_Pago","Semana","Fecha"] if c in df_x.columns]
+    append_sheet(wb, "Detalle", df_x[detalle_cols])
+
+    if dia is None and sem is None:
+        dia, sem = resumen_nomina(df_x)
+    if dia is not None:
+        append_sheet(wb, "Nomina_Diaria", dia)
+    if sem is not None:
+        append_sheet(wb, "Nomina_Semanal", sem)
+    wb.save(output)
     return output.getvalue()
 
 # =========================
 # Tabs
 # =========================
+def show_df(df: pd.DataFrame, key: str, default_rows: int = 500):
+    """st.dataframe acotado: solo envía al navegador las primeras default_rows filas salvo que se pida todo."""
+    n = len(df)
+    if n > default_rows and not st.checkbox(f"Mostrar todo ({n} filas)", key=key):
+        st.caption(f"Mostrando {default_rows} de {n} filas.")
+        df = df.head(default_rows)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+# Datos compartidos por todas las pestañas: una sola lectura por rerun
+rates = load_rates()
+modelos_std = load_model_std()
+modelos_cat = load_model_catalog()
+dept_all = dept_options_from(rates)
+
 tabs = st.tabs(["📲 Captura", "📈 Tablero", "📚 Plantillas & Diagramas", "✏️ Editar / Auditar", "🛠️ Admin"])
 
 # =========================
@@ -628,15 +933,13 @@ def _reset_emp_on_depto_change():
 
 with tabs[0]:
     st.subheader("Captura móvil")
-    rates = load_rates_csv()
-    dept_options = sorted(list(set(DEPT_FALLBACK) | set(rates["DEPTO"].dropna().astype(str).tolist()))) if not rates.empty else DEPT_FALLBACK
-    depto = st.selectbox("Departamento*", options=dept_options,
-                         index=0 if "cap_depto" not in st.session_state or st.session_state.get("cap_depto") not in dept_options
-                         else dept_options.index(st.session_state.get("cap_depto")),
+    depto = st.selectbox("Departamento*", options=dept_all,
+                         index=0 if "cap_depto" not in st.session_state or st.session_state.get("cap_depto") not in dept_all
+                         else dept_all.index(st.session_state.get("cap_depto")),
                          key="cap_depto", on_change=_reset_emp_on_depto_change,
                          help="Al cambiar, se reinicia y recarga el catálogo de empleados.")
     empleados_opts = emp_options_for(depto)
-    modelos_opts = load_model_catalog()
+    modelos_opts = modelos_cat
     if st.session_state.get("cap_emp_choice") not in ([PLACEHOLDER_EMP] + empleados_opts):
         st.session_state["cap_emp_choice"] = PLACEHOLDER_EMP
 
@@ -661,18 +964,17 @@ with tabs[0]:
 
             ahora_utc = now_utc()
             db = load_parquet(DB_FILE)
+            cierre = None
 
             # Cerrar trabajo abierto del mismo empleado (Inicio==Fin)
             if not db.empty and {"EMPLEADO", "Inicio", "Fin"}.issubset(db.columns):
-                try:
-                    db["Inicio"] = pd.to_datetime(db["Inicio"], errors="coerce", utc=True)
-                    db["Fin"] = pd.to_datetime(db["Fin"], errors="coerce", utc=True)
-                except Exception:
-                    pass
-
-                abiertos = db[(db["EMPLEADO"].astype(str) == str(empleado)) & db["Inicio"].notna() & db["Fin"].notna() & (db["Inicio"] == db["Fin"])]
-                if not abiertos.empty:
-                    idx_last = abiertos.index[-1]
+                fechas_utc(db)  # no-op si el parquet ya las trae tipadas
+
+                # primero las filas del empleado; Inicio/Fin solo se comparan en ese subconjunto
+                del_emp = db.loc[db["EMPLEADO"].astype(str) == str(empleado), ["Inicio", "Fin"]]
+                abiertos = del_emp.index[del_emp["Inicio"].notna() & (del_emp["Inicio"] == del_emp["Fin"])]
+                if len(abiertos):
+                    idx_last = abiertos[-1]
                     ini_prev_utc = db.at[idx_last, "Inicio"]
                     fin_prev_utc = ahora_utc
                     minutos_ef = working_minutes_between(ini_prev_utc, fin_prev_utc)
@@ -680,15 +982,12 @@ with tabs[0]:
 
                     db.at[idx_last, "Fin"] = fin_prev_utc
                     db.at[idx_last, "Minutos_Proceso"] = minutos_ef
-                    pago, esquema, tarifa = calc_pago_row(str(db.at[idx_last, "DEPTO"]).strip().upper(), produce_prev, minutos_ef, 0.0, rates)
+                    pago, esquema, tarifa = calc_pago_row(str(db.at[idx_last, "DEPTO"]).strip().upper(), produce_prev, minutos_ef, 0.0, rates_index(rates))
                     db.at[idx_last, "Pago"] = pago
                     db.at[idx_last, "Esquema_Pago"] = esquema
                     db.at[idx_last, "Tarifa_Base"] = tarifa
                     db.at[idx_last, "Estimado"] = False
-
-                    save_parquet(db, DB_FILE)
-                    log_audit(st.session_state.user, "auto-close", int(idx_last),
-                              {"empleado": empleado, "cerrado": fin_prev_utc, "minutos_efectivos": minutos_ef, "pago": pago})
+                    cierre = (int(idx_last), {"empleado": empleado, "cerrado": fin_prev_utc, "minutos_efectivos": minutos_ef, "pago": pago})
 
             # Nuevo registro "abierto" (UTC)
             row = {
@@ -706,20 +1005,75 @@ with tabs[0]:
                 "Esquema_Pago": "",
                 "Tarifa_Base": 0.0,
             }
-            db = load_parquet(DB_FILE)
+            # Un solo guardado para cierre + alta (se reutiliza el DataFrame ya cargado)
             db = pd.concat([db, pd.DataFrame([row])], ignore_index=True)
             save_parquet(db, DB_FILE)
+            if cierre:
+                log_audit(st.session_state.user, "auto-close", cierre[0], cierre[1])
             log_audit(st.session_state.user, "create", int(len(db) - 1), {"via": "ui", "row": row})
             st.success("Registro guardado ✅ (si había uno abierto, se cerró con minutos efectivos y pago).")
 
 # =========================
 # 📈 Tablero
 # =========================
+def opciones_filtro(s: pd.Series) -> List[Any]:
+    """Valores distintos y ordenados para un multiselect; si la columna es category salen de sus categorías sin recorrerla."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return sorted(s.cat.categories.tolist())
+    return sorted(s.dropna().unique().tolist())
+
+@st.fragment
+def tablero_view(show: pd.DataFrame):
+    """Filtros, tablas y export del Tablero; como fragmento, cambiar un filtro no recalcula minutos/pagos."""
+    c1, c2, c3 = st.columns(3)
+    f_depto = c1.multiselect("Departamento", opciones_filtro(show["DEPTO"]) if "DEPTO" in show.columns else [])
+    f_semana = c2.multiselect("Semana", opciones_filtro(show["Semana"]) if "Semana" in show.columns else [])
+    f_emp = c3.text_input("Empleado (contiene)")
+
+    # una sola máscara booleana y un solo recorte al final (sin copiar el histórico completo)
+    mask = np.ones(len(show), dtype=bool)
+    if f_depto:
+        mask &= show["DEPTO"].isin(f_depto).to_numpy()
+    if f_semana:
+        mask &= show["Semana"].isin(f_semana).to_numpy()
+    if f_emp.strip():
+        # subcadena literal (sin regex): más rápido y no falla con caracteres como "(" o "*"
+        mask &= show["EMPLEADO"].astype(str).str.lower().str.contains(f_emp.strip().lower(), regex=False, na=False).to_numpy(dtype=bool)
+    fdf = show if mask.all() else show[mask]
+    if fdf.empty:
+        st.info("Sin registros para los filtros seleccionados.")
+        return
+
+    # formateo legible local (Inicio/Fin ya vienen tipados en LOCAL_TZ desde compute_minutes_and_pay)
+    view = fdf.sort_values(by="Inicio", ascending=False) if "Inicio" in fdf.columns else fdf.copy()
+    for col in ["Inicio","Fin"]:
+        if col in view.columns:
+            view[col] = view[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    cols = [c for c in ["DEPTO","EMPLEADO","MODELO","Produce","Inicio","Fin","Minutos_Proceso","Minutos_Estandar","Pago","Pago_Estandar","Diferencia_Pago","Semana","Fecha"] if c in view.columns]
+    show_df(view[cols], key="tab_all_rows")
+
+    # Totales por día y por semana (incluye comparación) desde un solo groupby
+    st.markdown("### Pagos por día (real vs estándar)")
+    dia, sem = resumen_nomina(fdf)
+    if dia is not None:
+        show_df(dia.sort_values(["Fecha","EMPLEADO","MODELO"]), key="tab_dia_all_rows")
+
+    # Totales por semana (incluye comparación) + export
+    st.markdown("### Pagos por semana (real vs estándar)")
+    if sem is not None:
+        show_df(sem.sort_values(["Semana","EMPLEADO","MODELO"]), key="tab_sem_all_rows")
+
+        # el XLSX se arma solo al pulsar el botón (data diferida), no en cada render del Tablero
+        st.download_button("⬇️ Exportar nómina (Excel)", data=lambda: export_nomina(fdf, dia, sem),
+                           file_name=f"nomina_{datetime.now(LOCAL_TZ).date().isoformat()}.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           use_container_width=True)
+
 with tabs[1]:
     st.subheader("Producción en vivo")
-    base = load_parquet(DB_FILE)
-    rates = load_rates_csv()
-    modelos_std = load_model_std()
+    # solo las columnas que usan el cálculo y las vistas (Usuario, Esquema_Pago, etc. no se leen)
+    base = load_parquet(DB_FILE, columns=TABLERO_COLS)
     if base.empty:
         st.info("Sin registros.")
     else:
@@ -729,67 +1083,9 @@ with tabs[1]:
         if not rates.empty and "DEPTO" in show.columns:
             sin_tarifa = sorted(set(show["DEPTO"].dropna()) - set(rates["DEPTO"].dropna()))
             if sin_tarifa:
-                st.warning("Áreas sin tarifa en rates.csv: " + ", ".join(sin_tarifa))
-
-        c1, c2, c3 = st.columns(3)
-        f_depto = c1.multiselect("Departamento", sorted(show["DEPTO"].dropna().astype(str).unique().tolist()) if "DEPTO" in show.columns else [])
-        f_semana = c2.multiselect("Semana", sorted(pd.to_numeric(show["Semana"], errors="coerce").dropna().unique().tolist()) if "Semana" in show.columns else [])
-        f_emp = c3.text_input("Empleado (contiene)")
-
-        fdf = show.copy()
-        if not fdf.empty:
-            if f_depto:
-                fdf = fdf[fdf["DEPTO"].astype(str).isin(f_depto)]
-            if f_semana:
-                fdf = fdf[pd.to_numeric(fdf["Semana"], errors="coerce").isin(f_semana)]
-            if f_emp:
-                fdf = fdf[fdf["EMPLEADO"].astype(str).str.contains(f_emp, case=False, na=False)]
-
-        # formateo legible local
-        view = fdf.copy()
-        for col in ["Inicio","Fin"]:
-            if col in view.columns:
-                try:
-                    view[col] = pd.to_datetime(view[col], errors="coerce").dt.tz_convert(LOCAL_TZ).dt.strftime("%Y-%m-%d %H:%M:%S")
-                except Exception:
-                    pass
-
-        cols = [c for c in ["DEPTO","EMPLEADO","MODELO","Produce","Inicio","Fin","Minutos_Proceso","Minutos_Estandar","Pago","Pago_Estandar","Diferencia_Pago","Semana","Fecha"] if c in view.columns]
-        st.dataframe(view.sort_values(by="Inicio", ascending=False)[cols], use_container_width=True, hide_index=True)
-
-        # Totales por día (incluye comparación)
-        st.markdown("### Pagos por día (real vs estándar)")
-        if {"EMPLEADO","MODELO","Fecha","Pago","Pago_Estandar","Minutos_Proceso","Minutos_Estandar"}.issubset(fdf.columns):
-            dia = (fdf.groupby(["EMPLEADO","MODELO","Fecha"], dropna=False)
-                     .agg(Pagos_Real=("Pago","sum"),
-                          Pagos_Estandar=("Pago_Estandar","sum"),
-                          Minutos=("Minutos_Proceso","sum"),
-                          Min_Estd=("Minutos_Estandar","sum"),
-                          Piezas=("Produce","sum"))
-                     .reset_index())
-            dia["Horas"] = (dia["Minutos"] / 60).round(2)
-            dia["Diferencia"] = (dia["Pagos_Real"] - dia["Pagos_Estandar"]).round(2)
-            st.dataframe(dia.sort_values(["Fecha","EMPLEADO","MODELO"]), use_container_width=True, hide_index=True)
-
-        # Totales por semana (incluye comparación) + export
-        st.markdown("### Pagos por semana (real vs estándar)")
-        if {"EMPLEADO","MODELO","Semana","Pago","Pago_Estandar","Minutos_Proceso","Minutos_Estandar"}.issubset(fdf.columns):
-            sem = (fdf.groupby(["EMPLEADO","MODELO","Semana"], dropna=False)
-                     .agg(Pagos_Real=("Pago","sum"),
-                          Pagos_Estandar=("Pago_Estandar","sum"),
-                          Minutos=("Minutos_Proceso","sum"),
-                          Min_Estd=("Minutos_Estandar","sum"),
-                          Piezas=("Produce","sum"))
-                     .reset_index())
-            sem["Horas"] = (sem["Minutos"] / 60).round(2)
-            sem["Diferencia"] = (sem["Pagos_Real"] - sem["Pagos_Estandar"]).round(2)
-            st.dataframe(sem.sort_values(["Semana","EMPLEADO","MODELO"]), use_container_width=True, hide_index=True)
-
-            xls = export_nomina(fdf)
-            st.download_button("⬇️ Exportar nómina (Excel)", data=xls,
-                               file_name=f"nomina_{date.today().isoformat()}.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               use_container_width=True)
+                st.warning("Áreas sin tarifa registrada: " + ", ".join(sin_tarifa))
+
+        tablero_view(show)
 
 # =========================
 # 📚 Plantillas & Diagramas (PDF)
@@ -798,13 +1094,61 @@ def load_docs_index_or_empty():
     idx = load_docs_index()
     return idx if not idx.empty else pd.DataFrame(columns=["id", "departamento", "titulo", "tags", "filename", "relpath", "uploaded_by", "ts"])
 
+@st.fragment
+def docs_browser(idx: pd.DataFrame, dept_all: List[str]):
+    """Filtros + grid + visor de PDFs; como fragmento, buscar o abrir un PDF solo re-ejecuta esta sección."""
+    c1, c2 = st.columns([1, 2])
+    dept_filter = c1.multiselect("Departamento", dept_all)
+    q = c2.text_input("Buscar (título / tags / archivo)", placeholder="ej. corte, plantilla, tapiz...")
+
+    df = idx  # los filtros devuelven frames nuevos; no hace falta copiar el índice
+    if dept_filter:
+        df = df[df["departamento"].isin([norm_depto(d) for d in dept_filter])]
+    if q.strip():
+        qq = q.strip().lower()
+        # búsqueda vectorizada: título/tags/archivo unidos con un separador que no se escribe en la búsqueda
+        texto = (df["titulo"].fillna("") + "\x01" + df["tags"].fillna("") + "\x01" + df["filename"].fillna("")).str.lower()
+        df = df[texto.str.contains(qq, regex=False, na=False)]
+
+    df = df.sort_values(by="ts", ascending=False).reset_index(drop=True)
+    st.write(f"{len(df)} documento(s) encontrado(s).")
+
+    cols_per_row = 3
+    for i in range(0, len(df), cols_per_row):
+        cols = st.columns(cols_per_row)
+        for j, (_, r) in enumerate(df.iloc[i:i + cols_per_row].iterrows()):
+            with cols[j]:
+                path = r["relpath"]
+                abs_path = path if os.path.isabs(path) else os.path.join(".", path)
+                thumb = ensure_pdf_thumbnail(path)
+                if thumb and os.path.exists(thumb):
+                    st.image(thumb, use_container_width=True)
+                st.markdown(f"**{r['titulo']}**")
+                st.caption(f"{r['departamento']} · {r['filename']}")
+                cta1, cta2 = st.columns(2)
+                with cta1:
+                    if st.button("👁️ Ver", key=f"ver_{r['id']}"):
+                        st.session_state[f"open_{r['id']}"] = True
+                with cta2:
+                    # data diferida: el PDF solo se lee al pulsar Descargar, no en cada render del grid
+                    if os.path.exists(abs_path):
+                        st.download_button("⬇️ Descargar", data=lambda p=abs_path: read_file_bytes(p, file_mtime(p)),
+                                           file_name=os.path.basename(abs_path),
+                                           mime="application/pdf", key=f"dl_{r['id']}", use_container_width=True)
+                    else:
+                        st.error("Descarga falló: archivo no encontrado.")
+                if st.session_state.get(f"open_{r['id']}", False):
+                    show_pdf_file(abs_path, height=600)
+                    st.divider()
+                st.caption(f"Etiquetas: {r['tags'] or '—'} · Por: {r['uploaded_by']} · {r['ts']}")
+
 with tabs[2]:
     st.subheader("Plantillas & Diagramas (PDF)")
     st.caption("Sube y consulta PDFs por departamento. Vista previa + descarga.")
 
     if st.session_state.role == "Admin":
         with st.expander("⬆️ Subir nuevo PDF", expanded=False):
-            up_depto = st.selectbox("Departamento", sorted(list(set(DEPT_FALLBACK) | set(load_rates_csv()["DEPTO"].dropna().astype(str).tolist()))))
+            up_depto = st.selectbox("Departamento", dept_all)
             up_title = st.text_input("Título o descripción")
             up_tags = st.text_input("Etiquetas (separadas por comas)", placeholder="corte, guía, plantilla A")
             up_file = st.file_uploader("Archivo PDF", type=["pdf"])
@@ -821,61 +1165,25 @@ with tabs[2]:
                     relpath = os.path.relpath(save_path, ".").replace("\\", "/")
 
                     idx = load_docs_index()
-                    new_id = str(int(idx["id"].max()) + 1) if not idx.empty else "1"
+                    # ids guardados como texto: el máximo es numérico ("10" > "9"); ids vacíos o no numéricos se ignoran
+                    max_id = pd.to_numeric(idx["id"], errors="coerce").max()
+                    new_id = str(int(max_id) + 1) if pd.notna(max_id) else "1"
                     row = {"id": new_id, "departamento": norm_depto(up_depto), "titulo": (up_title.strip() if up_title else safe_name),
                            "tags": up_tags.strip(), "filename": safe_name, "relpath": relpath,
                            "uploaded_by": st.session_state.user, "ts": now_iso()}
-                    idx = pd.concat([idx, pd.DataFrame([row])], ignore_index=True)
-                    save_docs_index(idx)
-                    ensure_pdf_thumbnail(relpath)
-                    st.success("PDF guardado e indexado ✅")
+                    try:
+                        append_csv_row(DOCS_INDEX, row)
+                        _load_docs_index_cached.clear()
+                        ensure_pdf_thumbnail(relpath)
+                        st.success("PDF guardado e indexado ✅")
+                    except ValueError as e:
+                        st.error(f"PDF guardado pero no indexado: {e}")
 
     idx = load_docs_index_or_empty()
     if idx.empty:
         st.info("Aún no hay documentos. (Admin puede subirlos arriba)")
     else:
-        c1, c2 = st.columns([1, 2])
-        dept_filter = c1.multiselect("Departamento", sorted(list(set(DEPT_FALLBACK) | set(load_rates_csv()["DEPTO"].dropna().astype(str).tolist()))))
-        q = c2.text_input("Buscar (título / tags / archivo)", placeholder="ej. corte, plantilla, tapiz...")
-
-        df = idx.copy()
-        if dept_filter:
-            df = df[df["departamento"].isin([norm_depto(d) for d in dept_filter])]
-        if q.strip():
-            qq = q.strip().lower()
-            df = df[df.apply(lambda r: any(qq in str(r[col]).lower() for col in ["titulo", "tags", "filename"]), axis=1)]
-
-        df = df.sort_values(by="ts", ascending=False).reset_index(drop=True)
-        st.write(f"{len(df)} documento(s) encontrado(s).")
-
-        cols_per_row = 3
-        for i in range(0, len(df), cols_per_row):
-            cols = st.columns(cols_per_row)
-            for j, (_, r) in enumerate(df.iloc[i:i + cols_per_row].iterrows()):
-                with cols[j]:
-                    path = r["relpath"]
-                    abs_path = path if os.path.isabs(path) else os.path.join(".", path)
-                    thumb = ensure_pdf_thumbnail(path)
-                    if thumb and os.path.exists(thumb):
-                        st.image(thumb, use_container_width=True)
-                    st.markdown(f"**{r['titulo']}**")
-                    st.caption(f"{r['departamento']} · {r['filename']}")
-                    cta1, cta2 = st.columns(2)
-                    with cta1:
-                        if st.button("👁️ Ver", key=f"ver_{r['id']}"):
-                            st.session_state[f"open_{r['id']}"] = True
-                    with cta2:
-                        try:
-                            with open(abs_path, "rb") as f:
-                                data = f.read()
-                            st.download_button("⬇️ Descargar", data=data, file_name=os.path.basename(abs_path),
-                                               mime="application/pdf", key=f"dl_{r['id']}", use_container_width=True)
-                        except Exception as e:
-                            st.error(f"Descarga falló: {e}")
-                    if st.session_state.get(f"open_{r['id']}", False):
-                        show_pdf_file(abs_path, height=600)
-                        st.divider()
-                    st.caption(f"Etiquetas: {r['tags'] or '—'} · Por: {r['uploaded_by']} · {r['ts']}")
+        docs_browser(idx, dept_all)
 
 # =========================
 # ✏️ Editar / Auditar
@@ -883,7 +1191,6 @@ with tabs[2]:
 with tabs[3]:
     st.subheader("Edición (solo Admin mueve tiempos) + Bitácora")
     db = load_parquet(DB_FILE)
-    rates = load_rates_csv()
 
     if db.empty:
         st.info("No hay datos para editar.")
@@ -899,7 +1206,7 @@ with tabs[3]:
 
             with c1:
                 depto = st.selectbox("Departamento",
-                                     options=sorted(list(set(DEPT_FALLBACK) | set(rates["DEPTO"].dropna().astype(str).tolist()))) or DEPT_FALLBACK,
+                                     options=dept_all,
                                      index=0, key="audit_depto")
                 empleado = st.text_input("Empleado", value=str(row.get("EMPLEADO", "")), key="audit_empleado")
                 modelo   = st.text_input("Modelo",  value=str(row.get("MODELO", "")),  key="audit_modelo")
@@ -912,10 +1219,11 @@ with tabs[3]:
                 fin_local = to_local(fin_raw_utc) if pd.notna(fin_raw_utc) else None
 
                 if st.session_state.get("role") == "Admin":
-                    ini_date = st.date_input("Inicio (fecha)", ini_local.date() if ini_local else date.today(), key="audit_ini_date")
-                    ini_time = st.time_input("Inicio (hora)", (ini_local.time().replace(second=0, microsecond=0) if ini_local else datetime.now(LOCAL_TZ).time().replace(second=0, microsecond=0)), key="audit_ini_time")
-                    fin_date = st.date_input("Fin (fecha)", fin_local.date() if fin_local else date.today(), key="audit_fin_date")
-                    fin_time = st.time_input("Fin (hora)", (fin_local.time().replace(second=0, microsecond=0) if fin_local else datetime.now(LOCAL_TZ).time().replace(second=0, microsecond=0)), key="audit_fin_time")
+                    ahora_local = datetime.now(LOCAL_TZ).replace(second=0, microsecond=0)  # default único para los 4 widgets
+                    ini_date = st.date_input("Inicio (fecha)", ini_local.date() if ini_local else ahora_local.date(), key="audit_ini_date")
+                    ini_time = st.time_input("Inicio (hora)", (ini_local.time().replace(second=0, microsecond=0) if ini_local else ahora_local.time()), key="audit_ini_time")
+                    fin_date = st.date_input("Fin (fecha)", fin_local.date() if fin_local else ahora_local.date(), key="audit_fin_date")
+                    fin_time = st.time_input("Fin (hora)", (fin_local.time().replace(second=0, microsecond=0) if fin_local else ahora_local.time()), key="audit_fin_time")
                     inicio = to_utc(datetime.combine(ini_date, ini_time))
                     fin    = to_utc(datetime.combine(fin_date, fin_time))
                 else:
@@ -926,38 +1234,33 @@ with tabs[3]:
             submitted = st.form_submit_button("💾 Guardar cambios", type="primary", key="audit_submit")
 
         if submitted:
-            before = db.iloc[int(idx_num)].to_dict()
-
-            db.at[int(idx_num), "DEPTO"]        = norm_depto(depto)
-            db.at[int(idx_num), "EMPLEADO"]     = empleado
-            db.at[int(idx_num), "MODELO"]       = modelo
-            db.at[int(idx_num), "Produce"]      = num(produce)
+            i = int(idx_num)
+            before = db.iloc[i].to_dict()
+            updates = {"DEPTO": norm_depto(depto), "EMPLEADO": empleado, "MODELO": modelo, "Produce": num(produce)}
 
             if st.session_state.get("role") == "Admin":
-                db.at[int(idx_num), "Inicio"] = inicio
-                db.at[int(idx_num), "Fin"]    = fin
-
                 minutos_ef = working_minutes_between(inicio, fin)
-                db.at[int(idx_num), "Minutos_Proceso"] = minutos_ef
-
-                pago, esquema, tarifa = calc_pago_row(norm_depto(depto), num(produce), minutos_ef, 0.0, rates)
-                db.at[int(idx_num), "Pago"]         = pago
-                db.at[int(idx_num), "Esquema_Pago"] = esquema
-                db.at[int(idx_num), "Tarifa_Base"]  = tarifa
+                pago, esquema, tarifa = calc_pago_row(norm_depto(depto), num(produce), minutos_ef, 0.0, rates_index(rates))
+                updates.update({"Inicio": inicio, "Fin": fin, "Minutos_Proceso": minutos_ef,
+                                "Pago": pago, "Esquema_Pago": esquema, "Tarifa_Base": tarifa})
 
+            # una sola asignación por fila; "after" se arma del snapshot previo (sin volver a materializar la fila)
+            fechas_utc(db)  # Inicio/Fin nuevos son datetime: la columna no debe quedar mezclada con texto
+            db.loc[i, list(updates)] = list(updates.values())
             save_parquet(db, DB_FILE)
-            after = db.iloc[int(idx_num)].to_dict()
+            after = {**before, **updates}
             log_audit(st.session_state.get("user",""), "update", int(idx_num), {"before": before, "after": after})
             st.success("Actualizado ✅")
             st.rerun()
 
     st.markdown("---")
     st.subheader("Bitácora")
-    audit = load_parquet(AUDIT_FILE)
+    # la bitácora es append-only (orden cronológico): solo se cachean y ordenan las últimas 400 filas
+    audit = load_audit(tail=400)
     if audit.empty:
         st.caption("Sin eventos aún.")
     else:
-        st.dataframe(audit.sort_values(by="ts", ascending=False).head(400), use_container_width=True, hide_index=True)
+        st.dataframe(audit.sort_values(by="ts", ascending=False), use_container_width=True, hide_index=True)
 
 # =========================
 # 🛠️ Admin (incluye editor manual de tarifas + minutos estándar por modelo)
@@ -970,18 +1273,26 @@ with tabs[4]:
         emp_cat = load_emp_catalog()
         cA, cB = st.columns([1, 2])
         with cA:
-            dep_new = st.selectbox("Departamento", sorted(list(set(DEPT_FALLBACK) | set(load_rates_csv()["DEPTO"].dropna().astype(str).tolist()))), index=0, key="dep_new")
+            dep_new = st.selectbox("Departamento", dept_all, index=0, key="dep_new")
             emp_new = st.text_input("➕ Empleado nuevo")
             if st.button("Guardar empleado"):
-                merged = pd.concat([emp_cat, pd.DataFrame([{"departamento": dep_new, "empleado": emp_new}])], ignore_index=True)
-                save_emp_catalog(merged)
-                st.success("Empleado agregado al catálogo")
-                st.rerun()
+                emp_norm = _RE_ESPACIOS.sub(" ", emp_new).strip()
+                if not emp_norm:
+                    st.error("Indica un empleado.")
+                elif emp_norm in set(emp_options_for(dep_new)):
+                    st.info(f"El empleado **{emp_norm}** ya existe en {norm_depto(dep_new)}.")
+                else:
+                    try:
+                        add_emp_catalog(dep_new, emp_new)
+                        st.success("Empleado agregado al catálogo")
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(f"No se agregó el empleado: {e}")
         with cB:
             st.dataframe(emp_cat, use_container_width=True, hide_index=True)
-        st.download_button("⬇️ Descargar cat_empleados.csv", data=emp_cat.to_csv(index=False).encode("utf-8"), file_name="cat_empleados.csv", mime="text/csv")
+        st.download_button("⬇️ Descargar cat_empleados.csv", data=lambda: df_to_csv_bytes(emp_cat), file_name="cat_empleados.csv", mime="text/csv")
         up_emp = st.file_uploader("Subir cat_empleados.csv", type=["csv"])
-        if up_emp is not None:
+        if upload_nuevo(up_emp, "up_emp"):
             try:
                 dfu = pd.read_csv(up_emp, dtype=str)
                 if {"departamento", "empleado"}.issubset(dfu.columns):
@@ -996,20 +1307,29 @@ with tabs[4]:
 
         st.markdown("---")
         st.subheader("Catálogo de Modelos (global)")
-        mod_cat_list = load_model_catalog()
+        mod_cat_list = modelos_cat
         st.dataframe(pd.DataFrame({"modelo": mod_cat_list}), use_container_width=True, hide_index=True)
         nuevo_mod = st.text_input("➕ Modelo nuevo")
         if st.button("Guardar modelo"):
-            save_model_catalog(list(set(mod_cat_list + ([nuevo_mod] if nuevo_mod.strip() else []))))
-            st.success("Modelo agregado")
-            st.rerun()
-        st.download_button("⬇️ Descargar cat_modelos.csv", data=pd.DataFrame({"modelo": load_model_catalog()}).to_csv(index=False).encode("utf-8"), file_name="cat_modelos.csv", mime="text/csv")
+            nuevo = nuevo_mod.strip()
+            if not nuevo:
+                st.error("Indica un modelo.")
+            elif nuevo in set(mod_cat_list):
+                st.info(f"El modelo **{nuevo}** ya existe en el catálogo.")
+            else:
+                try:
+                    add_model_catalog(nuevo)
+                    st.success("Modelo agregado")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"No se agregó el modelo: {e}")
+        st.download_button("⬇️ Descargar cat_modelos.csv", data=lambda: df_to_csv_bytes(pd.DataFrame({"modelo": mod_cat_list})), file_name="cat_modelos.csv", mime="text/csv")
         up_mod = st.file_uploader("Subir cat_modelos.csv", type=["csv"], key="up_mod")
-        if up_mod is not None:
+        if upload_nuevo(up_mod, "up_mod"):
             try:
                 dfm = pd.read_csv(up_mod, dtype=str)
                 if "modelo" in dfm.columns:
-                    save_model_catalog(list(set(mod_cat_list + dfm["modelo"].dropna().astype(str).tolist())))
+                    save_model_catalog(mod_cat_list + dfm["modelo"].dropna().astype(str).tolist())
                     st.success("Catálogo de modelos actualizado")
                     st.rerun()
                 else:
@@ -1019,7 +1339,6 @@ with tabs[4]:
 
         st.markdown("---")
         st.subheader("Tarifas por Área (desde Excel)")
-        rates = load_rates_csv()
         if rates.empty:
             st.info("Aún no hay tarifas. Sube el Excel de la hoja 'tiempos'.")
         else:
@@ -1032,10 +1351,8 @@ with tabs[4]:
                 st.error("Adjunta un archivo Excel.")
             else:
                 try:
-                    xls = pd.ExcelFile(rates_file)
-                    sheet = sheet_name if sheet_name in xls.sheet_names else xls.sheet_names[0]
-                    xdf = pd.read_excel(xls, sheet_name=sheet)
-                    save_rates_csv(xdf)
+                    xdf, sheet = read_rates_excel(rates_file, sheet_name)
+                    save_rates(xdf)
                     with open(RATES_XLSX, "wb") as f:
                         f.write(rates_file.getbuffer())
                     st.success(f"Tarifas cargadas y normalizadas desde hoja '{sheet}' ✅")
@@ -1047,12 +1364,9 @@ with tabs[4]:
         st.markdown("---")
         st.subheader("Editor manual de tarifas por área")
 
-        _rates_existing = load_rates_csv()
-        _dept_all = (sorted(list(set(DEPT_FALLBACK) | set(_rates_existing["DEPTO"].dropna().astype(str).tolist()))) if not _rates_existing.empty else DEPT_FALLBACK)
-
         c1, c2, c3, c4 = st.columns([1.2, 1, 1, 1])
         with c1:
-            dep_in = st.selectbox("Departamento", _dept_all, index=0, key="rates_manual_depto")
+            dep_in = st.selectbox("Departamento", dept_all, index=0, key="rates_manual_depto")
         with c2:
             pago_sem = st.number_input("Pago por semana ($)", min_value=0.0, step=1.0, value=0.0, key="rates_manual_sem")
         with c3:
@@ -1070,7 +1384,7 @@ with tabs[4]:
         with colA:
             if st.button("💾 Guardar / Actualizar tarifa", type="primary", use_container_width=True, key="btn_save_manual_rate"):
                 dep_norm = norm_depto(dep_in)
-                rates_df = load_rates_csv()
+                rates_df = rates
                 if rates_df.empty:
                     rates_df = pd.DataFrame(columns=["DEPTO","precio_minuto","precio_pieza","precio_hora"])
 
@@ -1083,13 +1397,13 @@ with tabs[4]:
 
                 rates_df = rates_df[rates_df["DEPTO"] != dep_norm]
                 rates_df = pd.concat([rates_df, new_row], ignore_index=True).sort_values("DEPTO").reset_index(drop=True)
-                rates_df.to_csv(RATES_CSV, index=False)
+                save_rates(rates_df, normalize=False)
                 st.success(f"Tarifa de {dep_norm} guardada: ${precio_hora_calc:.2f}/h · ${precio_min_calc:.4f}/min")
                 st.rerun()
 
         with colB:
-            if not _rates_existing.empty:
-                st.dataframe(_rates_existing.sort_values("DEPTO").reset_index(drop=True), use_container_width=True, hide_index=True)
+            if not rates.empty:
+                st.dataframe(rates.sort_values("DEPTO").reset_index(drop=True), use_container_width=True, hide_index=True)
             else:
                 st.caption("Aún no hay tarifas guardadas. Usa el formulario para agregar la primera.")
 
@@ -1097,7 +1411,7 @@ with tabs[4]:
         st.markdown("---")
         st.subheader("Minutos estándar por MODELO (por pieza)")
 
-        std_df = load_model_std()
+        std_df = modelos_std
         st.dataframe(std_df, use_container_width=True, hide_index=True)
         mcol1, mcol2 = st.columns(2)
         with mcol1:
@@ -1121,11 +1435,11 @@ with tabs[4]:
                     st.error("Indica un modelo.")
         with cc2:
             st.download_button("⬇️ Descargar modelos_std.csv",
-                               data=std_df.to_csv(index=False).encode("utf-8"),
+                               data=lambda: df_to_csv_bytes(std_df),
                                file_name="modelos_std.csv", mime="text/csv", use_container_width=True)
         with cc3:
             up_std = st.file_uploader("Subir modelos_std.csv", type=["csv"], key="up_std_csv")
-            if up_std is not None:
+            if upload_nuevo(up_std, "up_std_csv"):
                 try:
                     dfu = pd.read_csv(up_std)
                     save_model_std(dfu)